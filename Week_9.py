@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
-import json
 import queue
+import threading
 import time
-from multiprocessing import Process, Manager
-from typing import Optional
+from typing import NamedTuple, Optional
 import os
-import requests
+import orjson
+import urllib3
+from urllib3.exceptions import NewConnectionError, ProtocolError, TimeoutError as HTTPTimeoutError
+from libcamera import controls
+from picamera2 import Picamera2
 from communication.android import AndroidLink, AndroidMessage
 from communication.stm32 import STMLink
 from consts import SYMBOL_MAP
@@ -27,6 +30,65 @@ class PiAction:
         return self._value
 
 
+# Image recognition API endpoints
+API_URL = f"http://{API_IP}:{API_PORT}"
+IMAGE_URL = f"{API_URL}/image"
+STATUS_URL = f"{API_URL}/status"
+STITCH_URL = f"{API_URL}/stitch"
+API_STATUS_TTL = 5  # Seconds for which the result of check_api is reused
+ANDROID_JOIN_TIMEOUT = 5  # Seconds to wait for each old Android thread to exit when reconnecting
+
+# Two-character prefixes of the commands that are forwarded to the STM32 (besides STOP)
+STM32_PREFIXES = frozenset({"ZZ", "UL", "UR", "PL", "PR", "RS", "OB"})
+
+# Commands to go around each obstacle, given the direction of the arrow on it
+SMALL_CMDS = {"Left Arrow": ("OB01", "UL00"), "Right Arrow": ("OB01", "UR00")}  # From the start, ack_count = 3 and 5
+NEAR_CMDS = {"Left Arrow": "UL00", "Right Arrow": "UR00"}  # Small obstacle seen up close, ack_count = 5
+LARGE_CMDS = {"Left Arrow": "PL01", "Right Arrow": "PR01"}  # Large obstacle, ack_count = 6
+
+# libcamera controls matching the option indices stored in PiLCConfig9.txt
+METERS = [controls.AeMeteringModeEnum.CentreWeighted, controls.AeMeteringModeEnum.Spot, controls.AeMeteringModeEnum.Matrix]
+AWBS = [None, controls.AwbModeEnum.Auto, controls.AwbModeEnum.Incandescent, controls.AwbModeEnum.Tungsten, controls.AwbModeEnum.Fluorescent, controls.AwbModeEnum.Indoor, controls.AwbModeEnum.Daylight, controls.AwbModeEnum.Cloudy]
+DENOISES = [controls.draft.NoiseReductionModeEnum.Off, controls.draft.NoiseReductionModeEnum.Minimal, controls.draft.NoiseReductionModeEnum.Fast, controls.draft.NoiseReductionModeEnum.HighQuality]
+
+
+def _shutter_us(shutter) -> int:
+    """Converts a shutter setting (negative values are 1/x seconds) to whole microseconds"""
+    if shutter < 0:
+        shutter = abs(1/shutter)
+    sspeed = int(shutter * 1000000)
+    if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
+        sspeed +=1
+    return sspeed
+
+
+# Shutter speeds selectable in PiLCConfig9.txt, in seconds (negative values are 1/x seconds) and in microseconds
+SHUTTERS = [-2000,-1600,-1250,-1000,-800,-640,-500,-400,-320,-288,-250,-240,-200,-160,-144,-125,-120,-100,-96,-80,-60,-50,-48,-40,-30,-25,-20,-15,-13,-10,-8,-6,-5,-4,-3,0.4,0.5,0.6,0.8,1,1.1,1.2,2,3,4,5,6,7,8,9,10,11,15,20,25,30,40,50,60,75,100,112,120,150,200,220,230,239,435]
+SHUTTERS_US = tuple(_shutter_us(shutter) for shutter in SHUTTERS)
+
+# New controls only reach the sensor a few frames after set_controls(), so frames are skipped until the exposure matches
+EXPOSURE_TOLERANCE = 0.05  # Relative difference accepted, the sensor rounds the exposure to whole lines
+EXPOSURE_SYNC_FRAMES = 10  # Frames to wait at most before saving anyway
+
+
+class CamCfg(NamedTuple):
+    """Camera tuning parameters read from PiLCConfig9.txt"""
+    mode: int
+    speed: int
+    gain: int
+    brightness: int
+    contrast: int
+    red: int
+    blue: int
+    ev: int
+    saturation: int
+    meter: int
+    awb: int
+    sharpness: int
+    denoise: int
+    quality: int
+
+
 class RaspberryPi:
     def __init__(self):
         # Initialize logger and communication objects with Android and STM
@@ -34,34 +96,58 @@ class RaspberryPi:
         self.android_link = AndroidLink()
         self.stm_link = STMLink()
 
-        # For sharing information between child processes
-        self.manager = Manager()
-
         # Set robot mode to be 1 (Path mode)
-        self.robot_mode = self.manager.Value('i', 1)
+        self.robot_mode = 1
 
         # Events
-        self.android_dropped = self.manager.Event()  # Set when the android link drops
+        self.android_dropped = threading.Event()  # Set when the android link drops
         # commands will be retrieved from commands queue when this event is set
-        self.unpause = self.manager.Event()
+        self.unpause = threading.Event()
+        # Set to ask the Android threads to exit, as threads cannot be killed.
+        # Replaced on every reconnect, so that a thread that has not exited yet still sees its own event set
+        self.android_stop = threading.Event()
 
         # Movement Lock
-        self.movement_lock = self.manager.Lock()
+        self.movement_lock = threading.Lock()
 
         # Queues
-        self.android_queue = self.manager.Queue() # Messages to send to Android
-        self.rpi_action_queue = self.manager.Queue() # Messages that need to be processed by RPi
-        self.command_queue = self.manager.Queue() # Messages that need to be processed by STM32, as well as snap commands
-
-        # Define empty processes
-        self.proc_recv_android = None
-        self.proc_recv_stm32 = None
-        self.proc_android_sender = None
-        self.proc_command_follower = None
-        self.proc_rpi_action = None
+        self.android_queue = queue.Queue() # Messages to send to Android
+        self.android_unsent: Optional[AndroidMessage] = None  # Message whose send failed, sent first after reconnecting
+        self.rpi_action_queue = queue.Queue() # Messages that need to be processed by RPi
+        self.command_queue = queue.Queue() # Messages that need to be processed by STM32, as well as snap commands
+
+        # Define empty threads
+        self.thread_recv_android = None
+        self.thread_recv_stm32 = None
+        self.thread_android_sender = None
+        self.thread_command_follower = None
+        self.thread_rpi_action = None
 
         self.ack_count = 0
-        self.near_flag = self.manager.Lock()
+        self.near_flag = threading.Lock()
+        # Handlers for the ACK counts at which the robot reaches an obstacle
+        self.ack_handlers = {3: self._on_first_obstacle, 6: self._on_second_obstacle}
+
+        # Camera tuning parameters, parsed once instead of on every snapshot
+        self.cam_config_file = f"/home/{os.getlogin()}/PiLCConfig9.txt"
+        self.cam_cfg = None
+        self.cam_cfg_mtime = None
+        self.cam_controls = None  # Controls that do not depend on the shutter speed
+        self.cam_awb_controls = None
+        self._load_cam_config()
+
+        # Camera is kept open for the whole run, snapshots are serialized with the camera lock
+        self.camera_lock = threading.Lock()
+        self.picam2 = Picamera2()
+        self.picam2.configure(self.picam2.create_still_configuration())
+        self._apply_cam_config()
+        self.picam2.start()
+
+        # Keep-alive HTTP connection pool for the API
+        self.http = urllib3.PoolManager(num_pools=1, maxsize=4)
+        # Last result of check_api, and when it was obtained
+        self.api_status = None
+        self.api_status_time = 0.0
 
     def start(self):
         """Starts the RPi orchestrator"""
@@ -79,27 +165,27 @@ class RaspberryPi:
             #self.small_direction = self.snap_and_rec("Small")
             #self.logger.info(f"PREINFER small direction is: {self.small_direction}")
 
-            # Define child processes
-            self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_recv_stm32 = Process(target=self.recv_stm)
-            self.proc_android_sender = Process(target=self.android_sender)
-            self.proc_command_follower = Process(target=self.command_follower)
-            self.proc_rpi_action = Process(target=self.rpi_action)
+            # Define child threads, all of them block on I/O so they do not need their own processes
+            self.thread_recv_android = threading.Thread(target=self.recv_android, daemon=True)
+            self.thread_recv_stm32 = threading.Thread(target=self.recv_stm, daemon=True)
+            self.thread_android_sender = threading.Thread(target=self.android_sender, daemon=True)
+            self.thread_command_follower = threading.Thread(target=self.command_follower, daemon=True)
+            self.thread_rpi_action = threading.Thread(target=self.rpi_action, daemon=True)
 
-            # Start child processes
-            self.proc_recv_android.start()
-            self.proc_recv_stm32.start()
-            self.proc_android_sender.start()
-            self.proc_command_follower.start()
-            self.proc_rpi_action.start()
+            # Start child threads
+            self.thread_recv_android.start()
+            self.thread_recv_stm32.start()
+            self.thread_android_sender.start()
+            self.thread_command_follower.start()
+            self.thread_rpi_action.start()
 
-            self.logger.info("Child Processes started")
+            self.logger.info("Child threads started")
 
             ### Start up complete ###
 
             # Send success message to Android
             self.android_queue.put(AndroidMessage('info', 'Robot is ready!'))
-            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode.value == 1 else 'manual'))
+            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode == 1 else 'manual'))
             
             
             
@@ -110,9 +196,10 @@ class RaspberryPi:
             self.stop()
 
     def stop(self):
-        """Stops all processes on the RPi and disconnects gracefully with Android and STM32"""
+        """Stops all threads on the RPi and disconnects gracefully with Android and STM32"""
         self.android_link.disconnect()
         self.stm_link.disconnect()
+        self.picam2.close()
         self.logger.info("Program exited!")
 
     def reconnect_android(self):
@@ -125,45 +212,45 @@ class RaspberryPi:
 
             self.logger.error("Android link is down!")
 
-            # Kill child processes
-            self.logger.debug("Killing android child processes")
-            self.proc_android_sender.kill()
-            self.proc_recv_android.kill()
-
-            # Wait for the child processes to finish
-            self.proc_android_sender.join()
-            self.proc_recv_android.join()
-            assert self.proc_android_sender.is_alive() is False
-            assert self.proc_recv_android.is_alive() is False
-            self.logger.debug("Android child processes killed")
+            # Stop child threads
+            self.logger.debug("Stopping android child threads")
+            self.android_stop.set()
 
-            # Clean up old sockets
+            # Clean up old sockets, this also wakes up recv_android if it is blocked on the socket
             self.android_link.disconnect()
 
+            # Wait for the child threads to finish, recv_android may be busy in near_flag.acquire() or snap_and_rec()
+            for thread in (self.thread_android_sender, self.thread_recv_android):
+                thread.join(timeout=ANDROID_JOIN_TIMEOUT)
+                if thread.is_alive():
+                    self.logger.error("Android child thread %s did not stop, it will exit once it is done", thread.name)
+            self.logger.debug("Android child threads stopped")
+            self.android_stop = threading.Event()
+
             # Reconnect
             self.android_link.connect()
 
-            # Recreate Android processes
-            self.proc_recv_android = Process(target=self.recv_android)
-            self.proc_android_sender = Process(target=self.android_sender)
+            # Recreate Android threads
+            self.thread_recv_android = threading.Thread(target=self.recv_android, daemon=True)
+            self.thread_android_sender = threading.Thread(target=self.android_sender, daemon=True)
 
-            # Start previously killed processes
-            self.proc_recv_android.start()
-            self.proc_android_sender.start()
+            # Start previously stopped threads
+            self.thread_recv_android.start()
+            self.thread_android_sender.start()
 
-            self.logger.info("Android child processes restarted")
+            self.logger.info("Android child threads restarted")
             self.android_queue.put(AndroidMessage("info", "You are reconnected!"))
-            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode.value == 1 else 'manual'))
+            self.android_queue.put(AndroidMessage('mode', 'path' if self.robot_mode == 1 else 'manual'))
 
             self.android_dropped.clear()
             
         
     def recv_android(self) -> None:
         """
-        [Child Process] Processes the messages received from Android
+        [Child Thread] Processes the messages received from Android
         """
-       
-        while True:
+        stop = self.android_stop
+        while not stop.is_set():
             msg_str: Optional[str] = None
             try:
                 msg_str = self.android_link.recv()
@@ -175,7 +262,7 @@ class RaspberryPi:
             if msg_str is None:
                 continue
 
-            message: dict = json.loads(msg_str)
+            message: dict = orjson.loads(msg_str)
 
             ## Command: Start Moving ##
             if message['cat'] == "control":
@@ -189,14 +276,10 @@ class RaspberryPi:
                     
                     # Small object direction detection
                     self.small_direction = self.snap_and_rec("Small")
-                    self.logger.info(f"HERE small direction is: {self.small_direction}")
-                    if self.small_direction == "Left Arrow": 
-                        self.command_queue.put("OB01") # ack_count = 3
-                        self.command_queue.put("UL00") # ack_count = 5
-                    elif self.small_direction == "Right Arrow":
-                        self.command_queue.put("OB01") # ack_count = 3
-                        self.command_queue.put("UR00") # ack_count = 5
-
+                    self.logger.info("HERE small direction is: %s", self.small_direction)
+                    if self.small_direction in SMALL_CMDS:
+                        for command in SMALL_CMDS[self.small_direction]:
+                            self.command_queue.put(command)
                     elif self.small_direction == None or self.small_direction == 'None':
                         self.logger.info("Acquiring near_flag log")
                         self.near_flag.acquire()             
@@ -212,7 +295,7 @@ class RaspberryPi:
                     
     def recv_stm(self) -> None:
         """
-        [Child Process] Receive acknowledgement messages from STM32, and release the movement lock
+        [Child Thread] Receive acknowledgement messages from STM32, and release the movement lock
         """
         while True:
 
@@ -228,69 +311,67 @@ class RaspberryPi:
                 except Exception:
                     self.logger.warning("Tried to release a released lock!")
 
-                self.logger.debug(f"ACK from STM32 received, ACK count now:{self.ack_count}")
+                self.logger.debug("ACK from STM32 received, ACK count now:%s", self.ack_count)
                 
                 
-                self.logger.info(f"self.ack_count: {self.ack_count}")
-                if self.ack_count == 3:
-                    try:
-                        self.near_flag.release()
-                        self.logger.debug("First ACK received, robot reached first obstacle!")
-                        self.small_direction = self.snap_and_rec("Small_Near")
-                        if self.small_direction == "Left Arrow": 
-                            self.command_queue.put("UL00") # ack_count = 5
-                        elif self.small_direction == "Right Arrow":
-                            self.command_queue.put("UR00") # ack_count = 5
-                        else:
-                            self.command_queue.put("UL00") # ack_count = 5
-                            self.logger.debug("Failed first one, going left by default!")
-                    # except:
-                        # self.logger.info("No need to release near_flag")
-                    
-                # if self.ack_count == 3:
-                    except:
-                        time.sleep(2)
-                        self.logger.debug("First ACK received, robot finished first obstacle!")
-                        self.large_direction = self.snap_and_rec("Large")
-                        if self.large_direction == "Left Arrow": 
-                            self.command_queue.put("PL01") # ack_count = 6
-                        elif self.large_direction == "Right Arrow":
-                            self.command_queue.put("PR01") # ack_count = 6
-                        else:
-                            self.command_queue.put("PR01") # ack_count = 6
-                            self.logger.debug("Failed second one, going right by default!")
-
-                if self.ack_count == 6:
-                    self.logger.debug("Second ACK received from STM32!")
-                    self.android_queue.put(AndroidMessage("status", "finished"))
-                    self.command_queue.put("FIN")
-
-                # except Exception:
-                #     self.logger.warning("Tried to release a released lock!")
+                self.logger.info("self.ack_count: %s", self.ack_count)
+                handler = self.ack_handlers.get(self.ack_count)
+                if handler is not None:
+                    handler()
             else:
                 self.logger.warning(
-                    f"Ignored unknown message from STM: {message}")
+                    "Ignored unknown message from STM: %s", message)
+
+    def _on_first_obstacle(self) -> None:
+        """Called on the third ACK, when the robot is at the first obstacle"""
+        # Snapping is slow, leave it to the rpi_action thread so the UART keeps being drained
+        # near_flag is held when the first obstacle could not be recognised from the start position
+        if self.near_flag.locked():
+            self.near_flag.release()
+            self.logger.debug("First ACK received, robot reached first obstacle!")
+            self.rpi_action_queue.put(PiAction(cat="snap_near", value="Small_Near"))
+        else:
+            self.logger.debug("First ACK received, robot finished first obstacle!")
+            self.rpi_action_queue.put(PiAction(cat="snap_large", value="Large"))
+
+    def _on_second_obstacle(self) -> None:
+        """Called on the sixth ACK, when the robot has gone around the second obstacle"""
+        self.logger.debug("Second ACK received from STM32!")
+        self.android_queue.put(AndroidMessage("status", "finished"))
+        self.command_queue.put("FIN")
 
     def android_sender(self) -> None:
-        while True:
-            try:
-                message: AndroidMessage = self.android_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
+        stop = self.android_stop
+        while not stop.is_set():
+            # Resend the message that failed on the previous link before taking new ones, to keep them in order
+            message: Optional[AndroidMessage] = self.android_unsent
+            self.android_unsent = None
+            if message is None:
+                try:
+                    message = self.android_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+            # The link may have been closed for a reconnect while waiting, keep the message for the new link
+            if stop.is_set():
+                self.android_unsent = message
+                break
 
             try:
                 self.android_link.send(message)
             except OSError:
+                # Keep the message for the new link and stop, the reconnect handler starts a new sender
+                self.android_unsent = message
                 self.android_dropped.set()
                 self.logger.debug("Event set: Android dropped")
+                break
 
     def command_follower(self) -> None:
         while True:
             command: str = self.command_queue.get()
             self.unpause.wait()
             self.movement_lock.acquire()
-            stm32_prefixes = ("STOP", "ZZ", "UL", "UR", "PL", "PR", "RS", "OB")
-            if command.startswith(stm32_prefixes):
+            if command[:2] in STM32_PREFIXES or command == "STOP":
                 self.stm_link.send(command)
             elif command == "FIN":
                 self.unpause.clear()
@@ -305,10 +386,85 @@ class RaspberryPi:
     def rpi_action(self):
         while True:
             action: PiAction = self.rpi_action_queue.get()
-            self.logger.debug(f"PiAction retrieved from queue: {action.cat} {action.value}")
+            self.logger.debug("PiAction retrieved from queue: %s %s", action.cat, action.value)
             if action.cat == "snap": self.snap_and_rec(obstacle_id=action.value)
+            elif action.cat == "snap_near":
+                self.small_direction = self.snap_and_rec(action.value)
+                if self.small_direction not in NEAR_CMDS:
+                    self.logger.debug("Failed first one, going left by default!")
+                self.command_queue.put(NEAR_CMDS.get(self.small_direction, "UL00")) # ack_count = 5
+            elif action.cat == "snap_large":
+                time.sleep(2)
+                self.large_direction = self.snap_and_rec(action.value)
+                if self.large_direction not in LARGE_CMDS:
+                    self.logger.debug("Failed second one, going right by default!")
+                self.command_queue.put(LARGE_CMDS.get(self.large_direction, "PR01")) # ack_count = 6
             elif action.cat == "stitch": self.request_stitch()
 
+    def _load_cam_config(self) -> None:
+        """Parses the camera tuning parameters from PiLCConfig9.txt"""
+        with open(self.cam_config_file, "r") as file:
+            config = [int(line) for line in file.read().split()]
+        self.cam_cfg = CamCfg(
+            mode=config[0],
+            speed=config[1],
+            gain=config[2],
+            brightness=config[3],
+            contrast=config[4],
+            red=config[6],
+            blue=config[7],
+            ev=config[8],
+            saturation=config[19],
+            meter=config[20],
+            awb=config[21],
+            sharpness=config[22],
+            denoise=config[23],
+            quality=config[24],
+        )
+        self.cam_cfg_mtime = os.stat(self.cam_config_file).st_mtime
+
+        cfg = self.cam_cfg
+        self.cam_controls = {
+            "Brightness": cfg.brightness/100,
+            "Contrast": cfg.contrast/100,
+            "AeMeteringMode": METERS[cfg.meter],
+            "Saturation": cfg.saturation/10,
+            "Sharpness": cfg.sharpness/10,
+            "NoiseReductionMode": DENOISES[cfg.denoise],
+            # Always set, so that a config edited back to 0 also resets the running camera
+            "ExposureValue": float(cfg.ev),
+            # A gain of 0 hands the gain back to the AGC, as with libcamera-still
+            "AnalogueGain": float(cfg.gain),
+        }
+        if cfg.awb == 0:
+            self.cam_awb_controls = {"AwbEnable": False, "ColourGains": (cfg.red/10, cfg.blue/10)}
+        else:
+            self.cam_awb_controls = {"AwbEnable": True, "AwbMode": AWBS[cfg.awb]}
+
+    def _apply_cam_config(self) -> None:
+        """Applies the camera tuning parameters that do not depend on the shutter speed"""
+        self.picam2.options["quality"] = self.cam_cfg.quality
+        self.picam2.set_controls(self.cam_controls)
+
+    def _capture_at_exposure(self, filename: str, sspeed: int) -> dict:
+        """
+        Saves the first frame taken with the requested exposure time (in microseconds) and returns its metadata.
+        The camera keeps running between calls, so frames may still carry the exposure left by a previous snapshot.
+        """
+        for frame in range(EXPOSURE_SYNC_FRAMES):
+            request = self.picam2.capture_request()
+            try:
+                metadata = request.get_metadata()
+                settled = abs(metadata["ExposureTime"] - sspeed) <= sspeed * EXPOSURE_TOLERANCE
+                if settled or frame == EXPOSURE_SYNC_FRAMES - 1:
+                    request.save("main", filename)
+                    break
+            finally:
+                request.release()
+        if not settled:
+            self.logger.warning("Exposure time did not settle: got %s us, wanted %s us", metadata["ExposureTime"], sspeed)
+        return metadata
+
     def snap_and_rec(self, obstacle_id: str) -> None:
         """
         RPi snaps an image and calls the API for image-rec.
@@ -316,139 +472,108 @@ class RaspberryPi:
         :param obstacle_id: the current obstacle ID
         """
         
-        self.logger.info(f"Capturing image for obstacle id: {obstacle_id}")
+        self.logger.info("Capturing image for obstacle id: %s", obstacle_id)
         signal = "C"
-        url = f"http://{API_IP}:{API_PORT}/image"
-        filename = f"{int(time.time())}_{obstacle_id}_{signal}.jpg"
-        
-        
-        con_file    = "PiLCConfig9.txt"
-        Home_Files  = []
-        Home_Files.append(os.getlogin())
-        config_file = "/home/" + Home_Files[0]+ "/" + con_file
-
-        extns        = ['jpg','png','bmp','rgb','yuv420','raw']
-        shutters     = [-2000,-1600,-1250,-1000,-800,-640,-500,-400,-320,-288,-250,-240,-200,-160,-144,-125,-120,-100,-96,-80,-60,-50,-48,-40,-30,-25,-20,-15,-13,-10,-8,-6,-5,-4,-3,0.4,0.5,0.6,0.8,1,1.1,1.2,2,3,4,5,6,7,8,9,10,11,15,20,25,30,40,50,60,75,100,112,120,150,200,220,230,239,435]
-        meters       = ['centre','spot','average']
-        awbs         = ['off','auto','incandescent','tungsten','fluorescent','indoor','daylight','cloudy']
-        denoises     = ['off','cdn_off','cdn_fast','cdn_hq']
-
-        config = []
-        with open(config_file, "r") as file:
-            line = file.readline()
-            while line:
-                config.append(line.strip())
-                line = file.readline()
-            config = list(map(int,config))
-        mode        = config[0]
-        speed       = config[1]
-        gain        = config[2]
-        brightness  = config[3]
-        contrast    = config[4]
-        red         = config[6]
-        blue        = config[7]
-        ev          = config[8]
-        extn        = config[15]
-        saturation  = config[19]
-        meter       = config[20]
-        awb         = config[21]
-        sharpness   = config[22]
-        denoise     = config[23]
-        quality     = config[24]
+        # Capture to tmpfs so the image never touches the SD card
+        filename = f"/dev/shm/{int(time.time())}_{obstacle_id}_{signal}.jpg"
         
         retry_count = 0
         
-        while True:
-        
-            retry_count += 1
-        
-            shutter = shutters[speed]
-            if shutter < 0:
-                shutter = abs(1/shutter)
-            sspeed = int(shutter * 1000000)
-            if (shutter * 1000000) - int(shutter * 1000000) > 0.5:
-                sspeed +=1
-                
-            rpistr = "libcamera-still -e " + extns[extn] + " -n -t 100 -o " + filename
-            rpistr += " --brightness " + str(brightness/100) + " --contrast " + str(contrast/100)
-            rpistr += " --shutter " + str(sspeed)
-            if ev != 0:
-                rpistr += " --ev " + str(ev)
-            if sspeed > 1000000 and mode == 0:
-                rpistr += " --gain " + str(gain) + " --immediate "
-            else:    
-                rpistr += " --gain " + str(gain)
-                if awb == 0:
-                    rpistr += " --awbgains " + str(red/10) + "," + str(blue/10)
-                else:
-                    rpistr += " --awb " + awbs[awb]
-            rpistr += " --metering " + meters[meter]
-            rpistr += " --saturation " + str(saturation/10)
-            rpistr += " --sharpness " + str(sharpness/10)
-            rpistr += " --quality " + str(quality)
-            rpistr += " --denoise "    + denoises[denoise]
-            rpistr += " --metadata - --metadata-format txt >> PiLibtext.txt"
-
-            os.system(rpistr)
-            
+        with self.camera_lock:
+            # Only re-read the camera config if it was edited since it was last loaded
+            if os.stat(self.cam_config_file).st_mtime != self.cam_cfg_mtime:
+                self._load_cam_config()
+                self._apply_cam_config()
+            cfg = self.cam_cfg
+            speed = cfg.speed
+
+            while True:
             
-            self.logger.debug("Requesting from image API")
+                retry_count += 1
             
-            response = requests.post(url, files={"file": (filename, open(filename,'rb'))})
+                sspeed = SHUTTERS_US[speed]
+
+                # Only the shutter speed changes between retries
+                shot_controls = {"ExposureTime": sspeed}
+                if sspeed > 1000000 and cfg.mode == 0:
+                    shot_controls.update(AwbEnable=True, AwbMode=controls.AwbModeEnum.Auto)
+                else:
+                    shot_controls.update(self.cam_awb_controls)
 
-            if response.status_code != 200:
-                self.logger.error("Something went wrong when requesting path from image-rec API. Please try again.")
-                return
+                self.picam2.set_controls(shot_controls)
+                metadata = self._capture_at_exposure(filename, sspeed)
+                self.logger.debug("Camera metadata: %s", metadata)
+                
+                self.logger.debug("Requesting from image API")
+                
+                with open(filename, 'rb') as image:
+                    data = image.read()
+                response = self.http.request("POST", IMAGE_URL, fields={"file": (os.path.basename(filename), data, "image/jpeg")}, retries=False)
 
-            results = json.loads(response.content)
+                if response.status != 200:
+                    self.logger.error("Something went wrong when requesting path from image-rec API. Please try again.")
+                    return
 
-            # Higher brightness retry
-            
-            if results['image_id'] != 'NA' or retry_count > 6:
-                break
-            elif retry_count <= 2:
-                self.logger.info(f"Image recognition results: {results}")
-                self.logger.info("Recapturing with same shutter speed...")
-            elif retry_count <= 4:
-                self.logger.info(f"Image recognition results: {results}")
-                self.logger.info("Recapturing with lower shutter speed...")
-                speed -= 1
-            elif retry_count == 5:
-                self.logger.info(f"Image recognition results: {results}")
-                self.logger.info("Recapturing with lower shutter speed...")
-                speed += 3
+                results = orjson.loads(response.data)
+
+                # Higher brightness retry
+                
+                if results['image_id'] != 'NA' or retry_count > 6:
+                    break
+                elif retry_count <= 2:
+                    self.logger.info("Image recognition results: %s", results)
+                    self.logger.info("Recapturing with same shutter speed...")
+                elif retry_count <= 4:
+                    self.logger.info("Image recognition results: %s", results)
+                    self.logger.info("Recapturing with lower shutter speed...")
+                    speed -= 1
+                elif retry_count == 5:
+                    self.logger.info("Image recognition results: %s", results)
+                    self.logger.info("Recapturing with lower shutter speed...")
+                    speed += 3
             
         ans = SYMBOL_MAP.get(results['image_id'])
-        self.logger.info(f"Image recognition results: {results} ({ans})")
+        self.logger.info("Image recognition results: %s (%s)", results, ans)
         return ans
 
     def request_stitch(self):
-        url = f"http://{API_IP}:{API_PORT}/stitch"
-        response = requests.get(url)
-        if response.status_code != 200:
+        response = self.http.request("GET", STITCH_URL, retries=False)
+        if response.status != 200:
             self.logger.error("Something went wrong when requesting stitch from the API.")
             return
         self.logger.info("Images stitched!")
 
     def clear_queues(self):
-        while not self.command_queue.empty():
-            self.command_queue.get()
+        while True:
+            try:
+                self.command_queue.get_nowait()
+            except queue.Empty:
+                break
 
     def check_api(self) -> bool:
-        url = f"http://{API_IP}:{API_PORT}/status"
+        """Checks whether the API is up, repeated checks within API_STATUS_TTL seconds reuse the last result"""
+        now = time.monotonic()
+        if self.api_status is None or now - self.api_status_time >= API_STATUS_TTL:
+            self.api_status = self._request_api_status()
+            self.api_status_time = now
+        return self.api_status
+
+    def _request_api_status(self) -> bool:
         try:
-            response = requests.get(url, timeout=1)
-            if response.status_code == 200:
+            response = self.http.request("GET", STATUS_URL, timeout=1.0, retries=False)
+            if response.status == 200:
                 self.logger.debug("API is up!")
                 return True
-        except ConnectionError:
+            return False
+        # NewConnectionError subclasses HTTPTimeoutError, so it has to be caught first
+        except (NewConnectionError, ProtocolError):
             self.logger.warning("API Connection Error")
             return False
-        except requests.Timeout:
+        except HTTPTimeoutError:
             self.logger.warning("API Timeout")
             return False
         except Exception as e:
-            self.logger.warning(f"API Exception: {e}")
+            self.logger.warning("API Exception: %s", e)
             return False
 
 if __name__ == "__main__":
@@ -1,8 +1,9 @@
-import json
+import logging
 import os
 import socket
 from typing import Optional
 import bluetooth
+import orjson
 from communication.link import Link
 
 
@@ -37,12 +38,12 @@ class AndroidMessage:
         return self._value
 
     @property
-    def jsonify(self) -> str:
+    def jsonify(self) -> bytes:
         """
-        Returns the message as a JSON string.
-        :return: JSON string representation of the message.
+        Returns the message as UTF-8 encoded JSON.
+        :return: JSON bytes representation of the message.
         """
-        return json.dumps({'cat': self._cat, 'value': self._value})
+        return orjson.dumps({'cat': self._cat, 'value': self._value})
 
 
 class AndroidLink(Link):
@@ -53,6 +54,7 @@ class AndroidLink(Link):
     ```json
     {"cat": "xxx", "value": "xxx"}
     ```
+    Each message is terminated by a newline (`\n`). A partial message left when the connection closes is discarded.
 
     The `cat` (for category) field with the following possible values:
     - `info`: general messages
@@ -114,6 +116,7 @@ class AndroidLink(Link):
         super().__init__()
         self.client_sock = None
         self.server_sock = None
+        self.recv_buffer = bytearray()
 
     def connect(self):
         """
@@ -138,46 +141,72 @@ class AndroidLink(Link):
                                         uuid, bluetooth.SERIAL_PORT_CLASS], profiles=[bluetooth.SERIAL_PORT_PROFILE])
 
             self.logger.info(
-                f"Awaiting Bluetooth connection on RFCOMM CHANNEL {port}")
+                "Awaiting Bluetooth connection on RFCOMM CHANNEL %s", port)
             self.client_sock, client_info = self.server_sock.accept()
-            self.logger.info(f"Accepted connection from: {client_info}")
+            self.recv_buffer = bytearray()
+            self.logger.info("Accepted connection from: %s", client_info)
 
         except Exception as e:
-            self.logger.error(f"Error in Bluetooth link connection: {e}")
+            self.logger.error("Error in Bluetooth link connection: %s", e)
             self.server_sock.close()
             self.client_sock.close()
 
     def disconnect(self):
         """Disconnect from Android Bluetooth connection and shutdown all the sockets established"""
-        try:
-            self.logger.debug("Disconnecting Bluetooth link")
-            self.server_sock.shutdown(socket.SHUT_RDWR)
-            self.client_sock.shutdown(socket.SHUT_RDWR)
-            self.client_sock.close()
-            self.server_sock.close()
-            self.client_sock = None
-            self.server_sock = None
-            self.logger.info("Disconnected Bluetooth link")
-        except Exception as e:
-            self.logger.error(f"Failed to disconnect Bluetooth link: {e}")
+        self.logger.debug("Disconnecting Bluetooth link")
+        # Client socket first, this is the one recv_android may be blocked on
+        for name in ("client_sock", "server_sock"):
+            sock = getattr(self, name)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError as e:
+                self.logger.error("Failed to shut down Bluetooth %s: %s", name, e)
+            try:
+                sock.close()
+            except OSError as e:
+                self.logger.error("Failed to close Bluetooth %s: %s", name, e)
+            setattr(self, name, None)
+        self.logger.info("Disconnected Bluetooth link")
 
     def send(self, message: AndroidMessage):
         """Send message to Android"""
         try:
-            self.client_sock.send(f"{message.jsonify}\n".encode("utf-8"))
-            self.logger.debug(f"Sent to Android: {message.jsonify}")
+            client_sock = self.client_sock
+            if client_sock is None:  # disconnect() was called, possibly from another thread
+                raise OSError("Bluetooth link is not connected")
+            data = message.jsonify
+            client_sock.send(data + b"\n")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Sent to Android: %s", data.decode('utf-8'))
         except OSError as e:
-            self.logger.error(f"Error sending message to Android: {e}")
+            self.logger.error("Error sending message to Android: %s", e)
             raise e
 
     def recv(self) -> Optional[str]:
         """Receive message from Android"""
         try:
-            tmp = self.client_sock.recv(1024)
-            self.logger.debug(tmp)
-            message = tmp.strip().decode("utf-8")
-            self.logger.debug(f"Received from Android: {message}")
+            client_sock = self.client_sock
+            if client_sock is None:  # disconnect() was called, possibly from another thread
+                raise OSError("Bluetooth link is not connected")
+            # RFCOMM does not preserve message boundaries, so buffer until a full line has arrived
+            while True:
+                while b"\n" not in self.recv_buffer:
+                    chunk = client_sock.recv(1024)
+                    if not chunk:
+                        # A message without its newline is incomplete, it is dropped rather than guessed at
+                        if self.recv_buffer.strip():
+                            self.logger.warning("Discarding unterminated message from Android: %r", bytes(self.recv_buffer))
+                        self.recv_buffer.clear()
+                        raise OSError("Connection closed by Android")
+                    self.recv_buffer += chunk
+                line, _, self.recv_buffer = self.recv_buffer.partition(b"\n")
+                message = line.strip().decode("utf-8")
+                if message:
+                    break
+            self.logger.debug("Received from Android: %s", message)
             return message
         except OSError as e:  # connection broken, try to reconnect
-            self.logger.error(f"Error receiving message from Android: {e}")
+            self.logger.error("Error receiving message from Android: %s", e)
             raise e
@@ -1,3 +1,4 @@
+from collections import deque
 from typing import Optional
 import serial
 from communication.link import Link
@@ -38,10 +39,18 @@ class STMLink(Link):
         """
         super().__init__()
         self.serial_link = None
+        self.rx_buffer = bytearray()  # Bytes received after the last complete line
+        self.rx_lines = deque()  # Complete lines not yet returned by recv()
 
     def connect(self):
         """Connect to STM32 using serial UART connection, given the serial port and the baud rate"""
-        self.serial_link = serial.Serial(SERIAL_PORT, BAUD_RATE)
+        # No read timeout: recv() waits for data in select(), which releases the GIL, instead of polling
+        self.serial_link = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=None, rtscts=False)
+        # Only supported by some platforms (e.g. Windows)
+        if hasattr(self.serial_link, "set_buffer_size"):
+            self.serial_link.set_buffer_size(rx_size=4096)
+        self.rx_buffer = bytearray()
+        self.rx_lines = deque()
         self.logger.info("Connected to STM32")
 
     def disconnect(self):
@@ -57,7 +66,7 @@ class STMLink(Link):
             message (str): message to send
         """
         self.serial_link.write(f"{message}".encode("utf-8"))
-        self.logger.debug(f"Sent to STM32: {message}")
+        self.logger.debug("Sent to STM32: %s", message)
 
     def recv(self) -> Optional[str]:
         """Receive a message from STM32, utf-8 decoded
@@ -65,6 +74,12 @@ class STMLink(Link):
         Returns:
             Optional[str]: message received
         """
-        message = self.serial_link.readline().strip().decode("utf-8")
-        self.logger.debug(f"Received from STM32: {message}")
+        # Block until at least one byte arrives, then read everything that is pending in one go instead of
+        # byte by byte as readline() does, and keep any extra lines for later calls
+        while not self.rx_lines:
+            self.rx_buffer += self.serial_link.read(max(1, self.serial_link.in_waiting))
+            *lines, self.rx_buffer = self.rx_buffer.split(b"\n")
+            self.rx_lines.extend(lines)
+        message = self.rx_lines.popleft().strip().decode("utf-8")
+        self.logger.debug("Received from STM32: %s", message)
         return message
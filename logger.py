@@ -1,10 +1,20 @@
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Writes the queued log records to the console and file handlers in a background thread
+listener = None
 
 
 def prepare_logger() -> logging.Logger:
     """
     Creates a logger that is able to both print to console and save to file.
+    Logging calls only enqueue the record, the actual I/O is done by a background listener thread.
     """
+    global listener
+
     log_format = logging.Formatter(
         '%(asctime)s :: %(levelname)s :: %(message)s')
 
@@ -17,13 +27,26 @@ def prepare_logger() -> logging.Logger:
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(log_format)
 
-        # File handler
+        # File handler, DEBUG is left out as writing every message to the SD card is slow
         file_handler = logging.FileHandler('logfile.txt')
-        file_handler.setLevel(logging.DEBUG)
+        file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(log_format)
 
-        # Add handlers to logger
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        # Add queue handler to logger
+        queue_handler = QueueHandler(queue.Queue(-1))
+        logger.addHandler(queue_handler)
+
+        listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        # The listener thread does not exist in forked child processes (Week 8), so they log to the handlers directly
+        def use_direct_handlers():
+            logger.removeHandler(queue_handler)
+            logger.addHandler(console_handler)
+            logger.addHandler(file_handler)
+            atexit.unregister(listener.stop)
+
+        os.register_at_fork(after_in_child=use_direct_handlers)
 
     return logger